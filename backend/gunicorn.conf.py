@@ -0,0 +1,19 @@
+"""
+Gunicorn configuration for the RedHat AI Security Agent
+Any setting can be overridden through the GUNICORN_CMD_ARGS environment variable.
+
+Attack plans, authorizations, the safety configuration and the id counters are
+held in each worker's memory, so the app must run as a single worker until that
+state moves to a shared store. Concurrency comes from threads instead.
+"""
+
+import os
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', 5000)}"
+workers = 1
+worker_class = "gthread"
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = 60
+chdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+accesslog = "-"
+errorlog = "-"
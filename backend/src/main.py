@@ -17,10 +17,12 @@ from routes.knowledge_base import knowledge_bp
 from routes.attack_engine import attack_bp
 from routes.safety_layer import safety_bp
 from utils.logger import setup_logging
+from utils.serialization import OrjsonProvider
 
 def create_app():
     """Create and configure the Flask application."""
     app = Flask(__name__)
+    app.json = OrjsonProvider(app)
     
     # Configuration
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-key-change-in-production')
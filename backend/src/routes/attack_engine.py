@@ -3,12 +3,18 @@ Attack Engine Routes - Attack Simulation and Execution Module
 Handles the planning and execution of simulated attacks for security testing.
 """
 
-from flask import Blueprint, jsonify, request
-import json
+from flask import Blueprint, Response, request
+import hashlib
+import orjson
 import os
+import secrets
+import threading
 from datetime import datetime
 from openai import OpenAI
+from utils.llm_cache import LLMCache
 from utils.logger import get_logger
+from utils.serialization import ojson, read_jsonl, stream_json_list
+from utils.storage import DATA_DIR, JsonlWriter
 
 attack_bp = Blueprint('attack', __name__)
 logger = get_logger('attack_engine')
@@ -16,32 +22,132 @@ logger = get_logger('attack_engine')
 # Initialize OpenAI client
 client = OpenAI()
 
+# Static technique catalogue, serialized once at import
+ATTACK_TECHNIQUES = {
+    "reconnaissance": (
+        "OSINT gathering",
+        "DNS enumeration", 
+        "Port scanning",
+        "Service fingerprinting",
+        "Social media reconnaissance"
+    ),
+    "vulnerability_assessment": (
+        "Web application scanning",
+        "Network vulnerability scanning",
+        "Configuration review",
+        "Code analysis",
+        "Privilege escalation testing"
+    ),
+    "exploitation": (
+        "SQL injection",
+        "Cross-site scripting (XSS)",
+        "Command injection",
+        "Buffer overflow",
+        "Authentication bypass"
+    ),
+    "post_exploitation": (
+        "Lateral movement",
+        "Data exfiltration simulation",
+        "Persistence mechanisms",
+        "Privilege escalation",
+        "Evidence collection"
+    )
+}
+
+TECHNIQUES_JSON = orjson.dumps({
+    "status": "success",
+    "techniques": ATTACK_TECHNIQUES
+})
+TECHNIQUES_ETAG = hashlib.blake2b(TECHNIQUES_JSON, digest_size=8).hexdigest()
+
+# Basic plan used when the model response is unavailable
+FALLBACK_PLAN = {
+    "reconnaissance": {
+        "techniques": ("Information gathering", "OSINT"),
+        "tools": ("nmap", "whois"),
+        "expected_outcomes": ("Network topology", "Service enumeration")
+    },
+    "vulnerability_assessment": {
+        "techniques": ("Port scanning", "Service enumeration"),
+        "tools": ("nessus", "openvas"),
+        "expected_outcomes": ("Vulnerability list", "Risk assessment")
+    }
+}
+
+# System prompt for attack planning, kept static so the provider can cache the prefix
+PLAN_SYSTEM_PROMPT = """
+You are an ethical hacking expert creating penetration testing plans.
+The user message is a JSON object with the target information and the objectives.
+Create a detailed attack plan for ethical penetration testing and return it as JSON with the following structure:
+{
+    "reconnaissance": {
+        "techniques": ["technique1", "technique2"],
+        "tools": ["tool1", "tool2"],
+        "expected_outcomes": ["outcome1", "outcome2"]
+    },
+    "vulnerability_assessment": {
+        "techniques": ["technique1", "technique2"],
+        "tools": ["tool1", "tool2"],
+        "expected_outcomes": ["outcome1", "outcome2"]
+    },
+    "exploitation": {
+        "techniques": ["technique1", "technique2"],
+        "tools": ["tool1", "tool2"],
+        "expected_outcomes": ["outcome1", "outcome2"]
+    },
+    "post_exploitation": {
+        "techniques": ["technique1", "technique2"],
+        "tools": ["tool1", "tool2"],
+        "expected_outcomes": ["outcome1", "outcome2"]
+    },
+    "risk_assessment": {
+        "severity": "low/medium/high/critical",
+        "impact": "description of potential impact",
+        "likelihood": "description of likelihood"
+    }
+}
+Focus on ethical hacking techniques and ensure all activities are within legal boundaries.
+"""
+
 class AttackEngine:
     """Attack simulation engine for planning and executing security tests."""
     
     def __init__(self):
-        self.data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data')
-        os.makedirs(self.data_dir, exist_ok=True)
-        self.attacks_file = os.path.join(self.data_dir, 'attacks.json')
+        self.data_dir = DATA_DIR
+        self.attacks_file = os.path.join(self.data_dir, 'attacks.jsonl')
+        self.llm_cache = LLMCache(os.path.join(self.data_dir, 'llm_cache'))
+        self._lock = threading.RLock()
+        self.attacks_writer = JsonlWriter(self.attacks_file)
         self.load_data()
     
     def load_data(self):
         """Load existing attack data from files."""
-        try:
-            with open(self.attacks_file, 'r') as f:
-                self.attacks = json.load(f)
-        except FileNotFoundError:
-            self.attacks = []
+        records = read_jsonl(self.attacks_file, os.path.join(self.data_dir, 'attacks.json'))
+        
+        # Simulation results are appended as delta records; a repeated full record for an id wins
+        latest = {}
+        for record in records:
+            if "simulation_result" in record:
+                attack = latest.get(record["id"])
+                if attack is not None:
+                    attack.setdefault("simulation_results", []).append(record["simulation_result"])
+            else:
+                latest[record["id"]] = record
+        self.attacks = list(latest.values())
+        self.attacks_by_id = latest
+        
+        if len(self.attacks) != len(records):
+            self.save_data()
     
     def save_data(self):
-        """Save attack data to files."""
-        with open(self.attacks_file, 'w') as f:
-            json.dump(self.attacks, f, indent=2)
+        """Rewrite the attack data file from memory, compacting it."""
+        with self._lock:
+            self.attacks_writer.rewrite(self.attacks)
     
     def plan_attack(self, target_info, objectives):
         """Plan an attack based on target information and objectives."""
         attack_plan = {
-            "id": len(self.attacks) + 1,
+            "id": secrets.token_hex(8),
             "timestamp": datetime.now().isoformat(),
             "target": target_info,
             "objectives": objectives,
@@ -49,92 +155,29 @@ class AttackEngine:
             "phases": []
         }
         
-        # Use AI to generate attack plan
-        prompt = f"""
-        As a cybersecurity expert, create a detailed attack plan for ethical penetration testing.
-        
-        Target Information:
-        {json.dumps(target_info, indent=2)}
-        
-        Objectives:
-        {json.dumps(objectives, indent=2)}
-        
-        Create a comprehensive attack plan with the following structure:
-        {{
-            "reconnaissance": {{
-                "techniques": ["technique1", "technique2"],
-                "tools": ["tool1", "tool2"],
-                "expected_outcomes": ["outcome1", "outcome2"]
-            }},
-            "vulnerability_assessment": {{
-                "techniques": ["technique1", "technique2"],
-                "tools": ["tool1", "tool2"],
-                "expected_outcomes": ["outcome1", "outcome2"]
-            }},
-            "exploitation": {{
-                "techniques": ["technique1", "technique2"],
-                "tools": ["tool1", "tool2"],
-                "expected_outcomes": ["outcome1", "outcome2"]
-            }},
-            "post_exploitation": {{
-                "techniques": ["technique1", "technique2"],
-                "tools": ["tool1", "tool2"],
-                "expected_outcomes": ["outcome1", "outcome2"]
-            }},
-            "risk_assessment": {{
-                "severity": "low/medium/high/critical",
-                "impact": "description of potential impact",
-                "likelihood": "description of likelihood"
-            }}
-        }}
-        
-        Focus on ethical hacking techniques and ensure all activities are within legal boundaries.
-        """
-        
         try:
-            response = client.chat.completions.create(
-                model="gpt-4.1-mini",
-                messages=[
-                    {"role": "system", "content": "You are an ethical hacking expert creating penetration testing plans."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3
-            )
-            
-            ai_response = response.choices[0].message.content
-            
-            # Extract JSON from response
-            start_idx = ai_response.find('{')
-            end_idx = ai_response.rfind('}') + 1
-            json_str = ai_response[start_idx:end_idx]
-            plan_data = json.loads(json_str)
-            
-            attack_plan["phases"] = plan_data
+            # Use AI to generate attack plan; the static system prompt is shared across requests
+            messages = [
+                {"role": "system", "content": PLAN_SYSTEM_PROMPT},
+                {"role": "user", "content": orjson.dumps({"target": target_info, "objectives": objectives}).decode()}
+            ]
+            attack_plan["phases"] = self.llm_cache.complete_json(client, "gpt-4.1-mini", messages, 0.3, orjson.loads)
             
         except Exception as e:
-            logger.error(f"Error generating attack plan: {str(e)}")
-            # Fallback to basic plan structure
-            attack_plan["phases"] = {
-                "reconnaissance": {
-                    "techniques": ["Information gathering", "OSINT"],
-                    "tools": ["nmap", "whois"],
-                    "expected_outcomes": ["Network topology", "Service enumeration"]
-                },
-                "vulnerability_assessment": {
-                    "techniques": ["Port scanning", "Service enumeration"],
-                    "tools": ["nessus", "openvas"],
-                    "expected_outcomes": ["Vulnerability list", "Risk assessment"]
-                }
-            }
+            logger.error("Error generating attack plan: %s", e)
+            # Fallback to basic plan structure; phases are never mutated so it is shared
+            attack_plan["phases"] = FALLBACK_PLAN
         
-        self.attacks.append(attack_plan)
-        self.save_data()
+        with self._lock:
+            self.attacks.append(attack_plan)
+            self.attacks_by_id[attack_plan["id"]] = attack_plan
+            self.attacks_writer.append(attack_plan)
         return attack_plan
     
     def simulate_attack_step(self, attack_id, phase, technique):
         """Simulate a specific attack step."""
         # Find the attack
-        attack = next((a for a in self.attacks if a["id"] == attack_id), None)
+        attack = self.attacks_by_id.get(attack_id)
         if not attack:
             return None
         
@@ -160,10 +203,12 @@ class AttackEngine:
         }
         
         # Update attack record
-        if "simulation_results" not in attack:
-            attack["simulation_results"] = []
-        attack["simulation_results"].append(simulation_result)
-        self.save_data()
+        with self._lock:
+            if "simulation_results" not in attack:
+                attack["simulation_results"] = []
+            attack["simulation_results"].append(simulation_result)
+            # Append only the new result; it is merged into the plan on load
+            self.attacks_writer.append({"id": attack_id, "simulation_result": simulation_result})
         
         return simulation_result
 
@@ -180,36 +225,32 @@ def create_attack_plan():
         objectives = data.get('objectives', [])
         
         if not target_info:
-            return jsonify({
+            return ojson({
                 "status": "error",
                 "message": "Target information is required"
             }), 400
         
         attack_plan = engine.plan_attack(target_info, objectives)
-        logger.info(f"Created attack plan {attack_plan['id']} for target {target_info.get('name', 'unknown')}")
+        logger.info("Created attack plan %s for target %s", attack_plan['id'], target_info.get('name', 'unknown'))
         
-        return jsonify({
+        return ojson({
             "status": "success",
             "message": "Attack plan created successfully",
             "attack_plan": attack_plan
         }), 201
         
     except Exception as e:
-        logger.error(f"Error creating attack plan: {str(e)}")
-        return jsonify({"status": "error", "message": str(e)}), 500
+        logger.error("Error creating attack plan: %s", e)
+        return ojson({"status": "error", "message": str(e)}), 500
 
 @attack_bp.route('/plans', methods=['GET'])
 def get_attack_plans():
     """Get all attack plans."""
     try:
-        return jsonify({
-            "status": "success",
-            "count": len(engine.attacks),
-            "attack_plans": engine.attacks
-        })
+        return stream_json_list({"status": "success"}, "attack_plans", engine.attacks)
     except Exception as e:
-        logger.error(f"Error retrieving attack plans: {str(e)}")
-        return jsonify({"status": "error", "message": str(e)}), 500
+        logger.error("Error retrieving attack plans: %s", e)
+        return ojson({"status": "error", "message": str(e)}), 500
 
 @attack_bp.route('/simulate', methods=['POST'])
 def simulate_attack():
@@ -222,7 +263,7 @@ def simulate_attack():
         technique = data.get('technique')
         
         if not all([attack_id, phase, technique]):
-            return jsonify({
+            return ojson({
                 "status": "error",
                 "message": "attack_id, phase, and technique are required"
             }), 400
@@ -230,66 +271,38 @@ def simulate_attack():
         result = engine.simulate_attack_step(attack_id, phase, technique)
         
         if not result:
-            return jsonify({
+            return ojson({
                 "status": "error",
                 "message": "Attack plan not found"
             }), 404
         
-        logger.info(f"Simulated attack step: {technique} in {phase} for attack {attack_id}")
+        logger.info("Simulated attack step: %s in %s for attack %s", technique, phase, attack_id)
         
-        return jsonify({
+        return ojson({
             "status": "success",
             "message": "Attack step simulated successfully",
             "result": result
         })
         
     except Exception as e:
-        logger.error(f"Error simulating attack: {str(e)}")
-        return jsonify({"status": "error", "message": str(e)}), 500
+        logger.error("Error simulating attack: %s", e)
+        return ojson({"status": "error", "message": str(e)}), 500
 
 @attack_bp.route('/techniques', methods=['GET'])
 def get_attack_techniques():
     """Get available attack techniques by category."""
     try:
-        techniques = {
-            "reconnaissance": [
-                "OSINT gathering",
-                "DNS enumeration", 
-                "Port scanning",
-                "Service fingerprinting",
-                "Social media reconnaissance"
-            ],
-            "vulnerability_assessment": [
-                "Web application scanning",
-                "Network vulnerability scanning",
-                "Configuration review",
-                "Code analysis",
-                "Privilege escalation testing"
-            ],
-            "exploitation": [
-                "SQL injection",
-                "Cross-site scripting (XSS)",
-                "Command injection",
-                "Buffer overflow",
-                "Authentication bypass"
-            ],
-            "post_exploitation": [
-                "Lateral movement",
-                "Data exfiltration simulation",
-                "Persistence mechanisms",
-                "Privilege escalation",
-                "Evidence collection"
-            ]
-        }
-        
-        return jsonify({
-            "status": "success",
-            "techniques": techniques
-        })
+        if request.if_none_match.contains_weak(TECHNIQUES_ETAG):
+            return Response(status=304, headers={'ETag': f'"{TECHNIQUES_ETAG}"'})
         
+        return Response(
+            TECHNIQUES_JSON,
+            mimetype='application/json',
+            headers={'ETag': f'"{TECHNIQUES_ETAG}"', 'Cache-Control': 'public, max-age=3600'}
+        )
     except Exception as e:
-        logger.error(f"Error retrieving techniques: {str(e)}")
-        return jsonify({"status": "error", "message": str(e)}), 500
+        logger.error("Error retrieving techniques: %s", e)
+        return ojson({"status": "error", "message": str(e)}), 500
 
 @attack_bp.route('/chatbot/test', methods=['POST'])
 def test_chatbot():
@@ -301,7 +314,7 @@ def test_chatbot():
         test_type = data.get('test_type', 'basic')
         
         if not chatbot_url:
-            return jsonify({
+            return ojson({
                 "status": "error",
                 "message": "Chatbot URL is required"
             }), 400
@@ -332,14 +345,14 @@ def test_chatbot():
             }
         }
         
-        logger.info(f"Completed chatbot security test for {chatbot_url}")
+        logger.info("Completed chatbot security test for %s", chatbot_url)
         
-        return jsonify({
+        return ojson({
             "status": "success",
             "message": "Chatbot security test completed",
             "results": test_results
         })
         
     except Exception as e:
-        logger.error(f"Error testing chatbot: {str(e)}")
-        return jsonify({"status": "error", "message": str(e)}), 500
+        logger.error("Error testing chatbot: %s", e)
+        return ojson({"status": "error", "message": str(e)}), 500
@@ -3,14 +3,25 @@ Knowledge Base Routes - Learning and Data Ingestion Module
 Handles the collection, processing, and storage of security knowledge.
 """
 
-from flask import Blueprint, jsonify, request
-import requests
-from bs4 import BeautifulSoup
-import json
+from flask import Blueprint, request
+import asyncio
+import atexit
+import httpx
+from selectolax.lexbor import LexborHTMLParser
+import orjson
 import os
+import pyarrow as pa
+import pyarrow.compute as pc
+import re
+import secrets
+import threading
+from collections import OrderedDict, defaultdict
 from datetime import datetime
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+from utils.llm_cache import LLMCache
 from utils.logger import get_logger
+from utils.serialization import ojson, read_jsonl, stream_jsonl_map
+from utils.storage import DATA_DIR, JsonlWriter
 
 knowledge_bp = Blueprint('knowledge', __name__)
 logger = get_logger('knowledge_base')
@@ -18,64 +29,281 @@ logger = get_logger('knowledge_base')
 # Initialize OpenAI client
 client = OpenAI()
 
+# Shared HTTP client so outbound fetches reuse pooled keep-alive connections
+http_client = httpx.Client(
+    http2=True,
+    follow_redirects=True,
+    timeout=30.0,
+    limits=httpx.Limits(max_keepalive_connections=32)
+)
+atexit.register(http_client.close)
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# Only the start of a page is analyzed, so never download more than this
+MAX_FETCH_BYTES = 256 * 1024
+ALLOWED_CONTENT_TYPES = ('text/html', 'text/plain')
+
+# Limits on a single /learn/urls request and on how many URLs it analyzes at once
+MAX_LEARN_URLS = 20
+LEARN_URLS_CONCURRENCY = 4
+
+# Recently fetched pages keyed by URL, revalidated with ETag/Last-Modified
+PAGE_CACHE_SIZE = 512
+page_cache = OrderedDict()
+page_cache_lock = threading.Lock()
+
+# Chunks added to the substring search column before they are merged into one
+SEARCH_COLUMN_MAX_CHUNKS = 64
+
+def search_text(technique):
+    """Join the searchable fields of a technique into one string."""
+    return '\n'.join([
+        technique.get('name', ''),
+        technique.get('description', ''),
+        ' '.join(technique.get('tags', []))
+    ])
+
+def is_valid_technique(technique):
+    """Check that a technique is an object whose text fields are strings and whose tags are a list of strings."""
+    if not isinstance(technique, dict):
+        return False
+    if not all(isinstance(technique.get(field, ''), str) for field in ('name', 'description', 'category')):
+        return False
+    tags = technique.get('tags', [])
+    return isinstance(tags, list) and all(isinstance(tag, str) for tag in tags)
+
+def tokenize(text):
+    """Split text into lowercased word tokens."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+def fetch_page(url, force=False):
+    """Fetch at most MAX_FETCH_BYTES of an HTML or plain text page, revalidating cached copies."""
+    headers = {}
+    cached = None
+    if not force:
+        with page_cache_lock:
+            cached = page_cache.get(url)
+            if cached:
+                page_cache.move_to_end(url)
+    if cached:
+        etag, last_modified, cached_content = cached
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+    
+    with http_client.stream('GET', url, headers=headers) as response:
+        if cached and response.status_code == 304:
+            return cached_content
+        
+        response.raise_for_status()
+        
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type and content_type not in ALLOWED_CONTENT_TYPES:
+            raise httpx.HTTPError(f"Unsupported content type: {content_type}")
+        
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > 64 * MAX_FETCH_BYTES:
+            raise httpx.HTTPError(f"Response too large: {content_length} bytes")
+        
+        content = bytearray()
+        for chunk in response.iter_bytes():
+            content += chunk
+            if len(content) >= MAX_FETCH_BYTES:
+                break
+        content = bytes(content[:MAX_FETCH_BYTES])
+        
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+    
+    if etag or last_modified:
+        with page_cache_lock:
+            page_cache[url] = (etag, last_modified, content)
+            page_cache.move_to_end(url)
+            if len(page_cache) > PAGE_CACHE_SIZE:
+                page_cache.popitem(last=False)
+    return content
+
+def extract_text(content):
+    """Extract the visible text the model will analyze from a fetched page."""
+    tree = LexborHTMLParser(content)
+    root = tree.body or tree.root
+    return root.text(separator=' ', strip=True)[:4000] if root else ''
+
+def build_extraction_messages(url, text_content):
+    """Build the chat messages asking the model to extract techniques from page text."""
+    prompt = f"""
+        Analyze the following security-related content and extract any hacking techniques, vulnerabilities, or security methods mentioned. 
+        Return the information in JSON format with the following structure:
+        {{
+            "techniques": [
+                {{
+                    "name": "technique name",
+                    "description": "detailed description",
+                    "category": "category (e.g., injection, social_engineering, etc.)",
+                    "severity": "low/medium/high/critical",
+                    "tags": ["tag1", "tag2"],
+                    "source_url": "{url}"
+                }}
+            ]
+        }}
+        
+        Content to analyze:
+        {text_content}
+        """
+    return [
+        {"role": "system", "content": "You are a cybersecurity expert analyzing security content."},
+        {"role": "user", "content": prompt}
+    ]
+
+def parse_extracted_techniques(ai_response):
+    """Parse the techniques list out of the model's JSON response, dropping malformed entries."""
+    techniques = orjson.loads(ai_response).get('techniques', [])
+    if not isinstance(techniques, list):
+        return []
+    return [technique for technique in techniques if is_valid_technique(technique)]
+
+async def analyze_url(async_client, url, force=False):
+    """Fetch a URL and extract techniques from it without blocking the event loop."""
+    content = await asyncio.to_thread(fetch_page, url, force)
+    messages = build_extraction_messages(url, extract_text(content))
+    return await kb.llm_cache.acomplete_json(
+        async_client, "gpt-4.1-mini", messages, 0.3, parse_extracted_techniques
+    )
+
+async def analyze_urls(urls, force=False):
+    """Analyze several URLs concurrently, returning techniques or an exception per URL."""
+    semaphore = asyncio.Semaphore(LEARN_URLS_CONCURRENCY)
+    
+    async def analyze_bounded(async_client, url):
+        async with semaphore:
+            return await analyze_url(async_client, url, force)
+    
+    async with AsyncOpenAI() as async_client:
+        return await asyncio.gather(
+            *(analyze_bounded(async_client, url) for url in urls),
+            return_exceptions=True
+        )
+
 class KnowledgeBase:
     """Knowledge base for storing and retrieving security information."""
     
     def __init__(self):
-        self.data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data')
-        os.makedirs(self.data_dir, exist_ok=True)
-        self.techniques_file = os.path.join(self.data_dir, 'techniques.json')
-        self.vulnerabilities_file = os.path.join(self.data_dir, 'vulnerabilities.json')
+        self.data_dir = DATA_DIR
+        self.techniques_file = os.path.join(self.data_dir, 'techniques.jsonl')
+        self.vulnerabilities_file = os.path.join(self.data_dir, 'vulnerabilities.jsonl')
+        self.llm_cache = LLMCache(os.path.join(self.data_dir, 'llm_cache'))
+        self._lock = threading.RLock()
+        self.techniques_writer = JsonlWriter(self.techniques_file)
+        self.vulnerabilities_writer = JsonlWriter(self.vulnerabilities_file)
         self.load_data()
+        self.build_index()
+        self.build_stats()
     
     def load_data(self):
         """Load existing data from files."""
-        try:
-            with open(self.techniques_file, 'r') as f:
-                self.techniques = json.load(f)
-        except FileNotFoundError:
-            self.techniques = []
-            
-        try:
-            with open(self.vulnerabilities_file, 'r') as f:
-                self.vulnerabilities = json.load(f)
-        except FileNotFoundError:
-            self.vulnerabilities = []
+        self.techniques = read_jsonl(self.techniques_file, os.path.join(self.data_dir, 'techniques.json'))
+        self.vulnerabilities = read_jsonl(self.vulnerabilities_file, os.path.join(self.data_dir, 'vulnerabilities.json'))
     
-    def save_data(self):
-        """Save data to files."""
-        with open(self.techniques_file, 'w') as f:
-            json.dump(self.techniques, f, indent=2)
+    def build_index(self):
+        """Build the token index used by technique search."""
+        self.index = defaultdict(set)
+        texts = [search_text(technique) for technique in self.techniques]
+        for position, text in enumerate(texts):
+            self.index_technique(position, text)
         
-        with open(self.vulnerabilities_file, 'w') as f:
-            json.dump(self.vulnerabilities, f, indent=2)
+        self.search_column = pa.chunked_array([], type=pa.large_string())
+        self.extend_search_column(texts)
+    
+    def index_technique(self, position, text):
+        """Add the tokens of a technique's searchable text to the token index."""
+        for token in tokenize(text):
+            self.index[token].add(position)
+    
+    def extend_search_column(self, texts):
+        """Append one chunk with the searchable text of new techniques to the substring search column."""
+        if not texts:
+            return
+        chunk = pa.array(texts, type=pa.large_string())
+        chunks = self.search_column.chunks + [chunk]
+        if len(chunks) > SEARCH_COLUMN_MAX_CHUNKS:
+            # Merge accumulated single-insert chunks so matching stays vectorized
+            chunks = [pa.concat_arrays(chunks)]
+        self.search_column = pa.chunked_array(chunks, type=pa.large_string())
+    
+    def build_stats(self):
+        """Compute the aggregates reported by the stats endpoint."""
+        self.categories = set()
+        self.last_updated = None
+        for technique in self.techniques:
+            self.update_stats(technique)
+    
+    def update_stats(self, technique):
+        """Fold a technique into the stats aggregates."""
+        self.categories.add(technique.get('category', 'unknown'))
+        timestamp = technique.get('timestamp', '')
+        if self.last_updated is None or timestamp > self.last_updated:
+            self.last_updated = timestamp
     
     def add_technique(self, technique_data):
         """Add a new technique to the knowledge base."""
-        technique_data['id'] = len(self.techniques) + 1
-        technique_data['timestamp'] = datetime.now().isoformat()
-        self.techniques.append(technique_data)
-        self.save_data()
-        return technique_data
+        return self.add_techniques([technique_data])[0]
+    
+    def add_techniques(self, techniques):
+        """Add several techniques to the knowledge base with a single write."""
+        # Everything that can fail runs before shared state is touched, so a bad batch leaves no trace
+        texts = [search_text(technique_data) for technique_data in techniques]
+        timestamp = datetime.now().isoformat()
+        for technique_data in techniques:
+            technique_data['id'] = secrets.token_hex(8)
+            technique_data['timestamp'] = timestamp
+        
+        with self._lock:
+            self.techniques_writer.extend(techniques)
+            for technique_data, text in zip(techniques, texts):
+                self.techniques.append(technique_data)
+                self.index_technique(len(self.techniques) - 1, text)
+                self.update_stats(technique_data)
+            self.extend_search_column(texts)
+        return techniques
     
     def add_vulnerability(self, vuln_data):
         """Add a new vulnerability to the knowledge base."""
-        vuln_data['id'] = len(self.vulnerabilities) + 1
+        vuln_data['id'] = secrets.token_hex(8)
         vuln_data['timestamp'] = datetime.now().isoformat()
-        self.vulnerabilities.append(vuln_data)
-        self.save_data()
+        with self._lock:
+            self.vulnerabilities.append(vuln_data)
+            self.vulnerabilities_writer.append(vuln_data)
         return vuln_data
     
+    def snapshot(self, records, writer):
+        """Flush a data file and map it read-only, returning the record count and the map."""
+        with self._lock:
+            return len(records), writer.map()
+    
     def search_techniques(self, query):
         """Search techniques by keyword."""
-        results = []
-        query_lower = query.lower()
-        for technique in self.techniques:
-            if (query_lower in technique.get('name', '').lower() or 
-                query_lower in technique.get('description', '').lower() or
-                query_lower in ' '.join(technique.get('tags', [])).lower()):
-                results.append(technique)
-        return results
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        
+        postings = sorted((self.index.get(token, set()) for token in set(tokens)), key=len)
+        positions = set.intersection(*postings)
+        return [self.techniques[position] for position in sorted(positions)]
+    
+    def search_techniques_substring(self, query):
+        """Search techniques for a case-insensitive substring of name, description or tags."""
+        with self._lock:
+            column = self.search_column
+            techniques = self.techniques
+        
+        # pyarrow crashes on a mask with no chunks, which an empty knowledge base produces
+        if len(column) == 0:
+            return []
+        
+        mask = pc.match_substring(column, query, ignore_case=True)
+        return [techniques[position] for position in pc.indices_nonzero(mask).to_pylist()]
 
 # Initialize knowledge base
 kb = KnowledgeBase()
@@ -84,14 +312,11 @@ kb = KnowledgeBase()
 def get_techniques():
     """Get all techniques from the knowledge base."""
     try:
-        return jsonify({
-            "status": "success",
-            "count": len(kb.techniques),
-            "techniques": kb.techniques
-        })
+        count, mapped = kb.snapshot(kb.techniques, kb.techniques_writer)
+        return stream_jsonl_map({"status": "success"}, "techniques", count, mapped)
     except Exception as e:
-        logger.error(f"Error retrieving techniques: {str(e)}")
-        return jsonify({"status": "error", "message": str(e)}), 500
+        logger.error("Error retrieving techniques: %s", e)
+        return ojson({"status": "error", "message": str(e)}), 500
 
 @knowledge_bp.route('/techniques', methods=['POST'])
 def add_technique():
@@ -103,38 +328,47 @@ def add_technique():
         required_fields = ['name', 'description', 'category']
         for field in required_fields:
             if field not in data:
-                return jsonify({
+                return ojson({
                     "status": "error", 
                     "message": f"Missing required field: {field}"
                 }), 400
         
+        if not is_valid_technique(data):
+            return ojson({
+                "status": "error",
+                "message": "name, description and category must be strings and tags a list of strings"
+            }), 400
+        
         technique = kb.add_technique(data)
-        logger.info(f"Added new technique: {technique['name']}")
+        logger.info("Added new technique: %s", technique['name'])
         
-        return jsonify({
+        return ojson({
             "status": "success",
             "message": "Technique added successfully",
             "technique": technique
         }), 201
         
     except Exception as e:
-        logger.error(f"Error adding technique: {str(e)}")
-        return jsonify({"status": "error", "message": str(e)}), 500
+        logger.error("Error adding technique: %s", e)
+        return ojson({"status": "error", "message": str(e)}), 500
 
 @knowledge_bp.route('/techniques/search', methods=['GET'])
 def search_techniques():
-    """Search techniques by query."""
+    """Search techniques by query; pass match=substring for substring matching."""
     try:
         query = request.args.get('q', '')
         if not query:
-            return jsonify({
+            return ojson({
                 "status": "error",
                 "message": "Query parameter 'q' is required"
             }), 400
         
-        results = kb.search_techniques(query)
+        if request.args.get('match') == 'substring':
+            results = kb.search_techniques_substring(query)
+        else:
+            results = kb.search_techniques(query)
         
-        return jsonify({
+        return ojson({
             "status": "success",
             "query": query,
             "count": len(results),
@@ -142,8 +376,8 @@ def search_techniques():
         })
         
     except Exception as e:
-        logger.error(f"Error searching techniques: {str(e)}")
-        return jsonify({"status": "error", "message": str(e)}), 500
+        logger.error("Error searching techniques: %s", e)
+        return ojson({"status": "error", "message": str(e)}), 500
 
 @knowledge_bp.route('/learn/url', methods=['POST'])
 def learn_from_url():
@@ -153,120 +387,117 @@ def learn_from_url():
         url = data.get('url')
         
         if not url:
-            return jsonify({
+            return ojson({
                 "status": "error",
                 "message": "URL is required"
             }), 400
         
         # Fetch content from URL
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        
-        # Parse HTML content
-        soup = BeautifulSoup(response.content, 'html.parser')
+        content = fetch_page(url, force=request.args.get('force') == 'true')
         
-        # Extract text content
-        text_content = soup.get_text()
-        
-        # Use AI to analyze and extract security techniques
-        prompt = f"""
-        Analyze the following security-related content and extract any hacking techniques, vulnerabilities, or security methods mentioned. 
-        Return the information in JSON format with the following structure:
-        {{
-            "techniques": [
-                {{
-                    "name": "technique name",
-                    "description": "detailed description",
-                    "category": "category (e.g., injection, social_engineering, etc.)",
-                    "severity": "low/medium/high/critical",
-                    "tags": ["tag1", "tag2"],
-                    "source_url": "{url}"
-                }}
-            ]
-        }}
-        
-        Content to analyze:
-        {text_content[:4000]}  # Limit content to avoid token limits
-        """
-        
-        response = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[
-                {"role": "system", "content": "You are a cybersecurity expert analyzing security content."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3
-        )
-        
-        # Parse AI response
-        ai_response = response.choices[0].message.content
+        # Use AI to analyze and extract security techniques, reusing answers for unchanged pages
+        messages = build_extraction_messages(url, extract_text(content))
         
         try:
-            # Extract JSON from response
-            start_idx = ai_response.find('{')
-            end_idx = ai_response.rfind('}') + 1
-            json_str = ai_response[start_idx:end_idx]
-            extracted_data = json.loads(json_str)
+            techniques = kb.llm_cache.complete_json(client, "gpt-4.1-mini", messages, 0.3, parse_extracted_techniques)
             
             # Add techniques to knowledge base
-            added_techniques = []
-            for technique_data in extracted_data.get('techniques', []):
-                technique = kb.add_technique(technique_data)
-                added_techniques.append(technique)
+            added_techniques = kb.add_techniques(techniques)
             
-            logger.info(f"Learned {len(added_techniques)} techniques from {url}")
+            logger.info("Learned %s techniques from %s", len(added_techniques), url)
             
-            return jsonify({
+            return ojson({
                 "status": "success",
                 "message": f"Successfully learned {len(added_techniques)} techniques",
                 "techniques": added_techniques,
                 "source_url": url
             })
             
-        except json.JSONDecodeError:
-            logger.error(f"Failed to parse AI response as JSON: {ai_response}")
-            return jsonify({
+        except orjson.JSONDecodeError as e:
+            logger.error("Failed to parse AI response as JSON: %s", e)
+            return ojson({
                 "status": "error",
                 "message": "Failed to parse extracted techniques"
             }), 500
         
-    except requests.RequestException as e:
-        logger.error(f"Error fetching URL {url}: {str(e)}")
-        return jsonify({
+    except httpx.HTTPError as e:
+        logger.error("Error fetching URL %s: %s", url, e)
+        return ojson({
             "status": "error",
             "message": f"Failed to fetch URL: {str(e)}"
         }), 400
         
     except Exception as e:
-        logger.error(f"Error learning from URL: {str(e)}")
-        return jsonify({"status": "error", "message": str(e)}), 500
+        logger.error("Error learning from URL: %s", e)
+        return ojson({"status": "error", "message": str(e)}), 500
+
+@knowledge_bp.route('/learn/urls', methods=['POST'])
+def learn_from_urls():
+    """Learn new techniques from several URLs concurrently."""
+    try:
+        data = request.get_json()
+        urls = data.get('urls')
+        
+        if not urls or not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+            return ojson({
+                "status": "error",
+                "message": "A list of URLs is required"
+            }), 400
+        
+        if len(urls) > MAX_LEARN_URLS:
+            return ojson({
+                "status": "error",
+                "message": f"At most {MAX_LEARN_URLS} URLs can be learned from at once"
+            }), 400
+        
+        results = asyncio.run(analyze_urls(urls, force=request.args.get('force') == 'true'))
+        
+        extracted = []
+        errors = []
+        for url, result in zip(urls, results):
+            if isinstance(result, Exception):
+                logger.error("Error learning from URL %s: %s", url, result)
+                errors.append({"url": url, "message": str(result)})
+            else:
+                extracted.extend(result)
+        
+        added_techniques = kb.add_techniques(extracted)
+        logger.info("Learned %s techniques from %s URLs", len(added_techniques), len(urls) - len(errors))
+        
+        return ojson({
+            "status": "success",
+            "message": f"Successfully learned {len(added_techniques)} techniques",
+            "techniques": added_techniques,
+            "errors": errors
+        })
+        
+    except Exception as e:
+        logger.error("Error learning from URLs: %s", e)
+        return ojson({"status": "error", "message": str(e)}), 500
 
 @knowledge_bp.route('/vulnerabilities', methods=['GET'])
 def get_vulnerabilities():
     """Get all vulnerabilities from the knowledge base."""
     try:
-        return jsonify({
-            "status": "success",
-            "count": len(kb.vulnerabilities),
-            "vulnerabilities": kb.vulnerabilities
-        })
+        count, mapped = kb.snapshot(kb.vulnerabilities, kb.vulnerabilities_writer)
+        return stream_jsonl_map({"status": "success"}, "vulnerabilities", count, mapped)
     except Exception as e:
-        logger.error(f"Error retrieving vulnerabilities: {str(e)}")
-        return jsonify({"status": "error", "message": str(e)}), 500
+        logger.error("Error retrieving vulnerabilities: %s", e)
+        return ojson({"status": "error", "message": str(e)}), 500
 
 @knowledge_bp.route('/stats', methods=['GET'])
 def get_stats():
     """Get knowledge base statistics."""
     try:
-        return jsonify({
+        return ojson({
             "status": "success",
             "stats": {
                 "total_techniques": len(kb.techniques),
                 "total_vulnerabilities": len(kb.vulnerabilities),
-                "categories": list(set([t.get('category', 'unknown') for t in kb.techniques])),
-                "last_updated": max([t.get('timestamp', '') for t in kb.techniques] + ['']) if kb.techniques else None
+                "categories": list(kb.categories),
+                "last_updated": kb.last_updated
             }
         })
     except Exception as e:
-        logger.error(f"Error retrieving stats: {str(e)}")
-        return jsonify({"status": "error", "message": str(e)}), 500
+        logger.error("Error retrieving stats: %s", e)
+        return ojson({"status": "error", "message": str(e)}), 500
@@ -3,24 +3,125 @@ Safety Layer Routes - Ethical Constraints and Safety Protocols
 Ensures all activities comply with ethical hacking guidelines and legal boundaries.
 """
 
-from flask import Blueprint, jsonify, request
-import json
+from flask import Blueprint, Response, has_request_context, jsonify, request
+import ahocorasick
+import atexit
+import functools
+import hashlib
+import itertools
+import orjson
 import os
-from datetime import datetime
+import queue
+import threading
+import time
+from collections import deque
+from datetime import date, datetime
 from utils.logger import get_logger
+from utils.serialization import ojson, read_jsonl
+from utils.storage import DATA_DIR
 
 safety_bp = Blueprint('safety', __name__)
 logger = get_logger('safety_layer')
 
+# Upper bound on the buffers passed to a single writev call
+IOV_MAX = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') else 1024
+
+# Only the most recent audit entries are kept in memory; older ones remain on disk
+AUDIT_LOG_MAXLEN = int(os.environ.get('AUDIT_LOG_MAXLEN', 100_000))
+
+# The audit log is sharded into daily files; only the most recent ones are loaded on startup
+AUDIT_LOG_LOAD_SHARDS = int(os.environ.get('AUDIT_LOG_LOAD_SHARDS', 1))
+
+# Objectives containing any of these (lowercase) terms are flagged as dangerous
+DANGEROUS_TECHNIQUES = (
+    "data_destruction",
+    "system_compromise",
+    "unauthorized_access",
+    "malware_deployment"
+)
+
+DANGEROUS_TECHNIQUES_AUTOMATON = ahocorasick.Automaton()
+for technique in DANGEROUS_TECHNIQUES:
+    DANGEROUS_TECHNIQUES_AUTOMATON.add_word(technique, technique)
+DANGEROUS_TECHNIQUES_AUTOMATON.make_automaton()
+
+SAFETY_RECOMMENDATIONS = (
+    "Ensure all testing is conducted in a controlled environment",
+    "Obtain proper written authorization before testing",
+    "Document all activities for compliance purposes",
+    "Follow responsible disclosure practices for any findings"
+)
+
+# Shared result for requests that pass every check; callers must not mutate it
+VALID_RESULT = {
+    "valid": True,
+    "warnings": (),
+    "errors": (),
+    "recommendations": SAFETY_RECOMMENDATIONS
+}
+
+@functools.lru_cache(maxsize=1024)
+def extract_domain(url):
+    """Extract domain from URL."""
+    if url.startswith(('http://', 'https://')):
+        url = url.partition('//')[2]
+    return url.partition('/')[0]
+
+def parse_expiry(expiry_date):
+    """Convert an ISO expiry date to epoch seconds, or None if there is no expiry."""
+    if not expiry_date:
+        return None
+    return datetime.fromisoformat(expiry_date).timestamp()
+
+def format_audit_entry(entry):
+    """Return an audit entry with its nanosecond timestamp rendered as ISO 8601."""
+    timestamp = entry.get("timestamp")
+    if isinstance(timestamp, int):
+        seconds, nanoseconds = divmod(timestamp, 1_000_000_000)
+        formatted = datetime.fromtimestamp(seconds).replace(microsecond=nanoseconds // 1000).isoformat()
+        return {**entry, "timestamp": formatted}
+    return entry
+
+# Latest serialized body and ETag per endpoint, keyed by the version of the data it was built from
+response_cache = {}
+
+def cached_json_response(name, version, build):
+    """Serve a JSON body cached per data version, honoring If-None-Match."""
+    cached = response_cache.get(name)
+    if cached is None or cached[0] != version:
+        body = orjson.dumps(build())
+        cached = (version, body, hashlib.blake2b(body, digest_size=8).hexdigest())
+        response_cache[name] = cached
+    
+    _, body, etag = cached
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
+    return Response(body, mimetype='application/json', headers={'ETag': f'"{etag}"'})
+
 class SafetyLayer:
     """Safety layer for enforcing ethical constraints and monitoring activities."""
     
-    def __init__(self):
-        self.data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data')
-        os.makedirs(self.data_dir, exist_ok=True)
-        self.audit_file = os.path.join(self.data_dir, 'audit_log.json')
+    def __init__(self, flush_interval_s=0.5, flush_batch_size=256):
+        self.data_dir = DATA_DIR
         self.authorized_targets_file = os.path.join(self.data_dir, 'authorized_targets.json')
         self.load_data()
+        self.open_audit_shard(date.today())
+        
+        # Audit entries and dirty files are persisted in batches by a background thread
+        self.flush_interval_s = flush_interval_s
+        self.flush_batch_size = flush_batch_size
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._write_queue = queue.Queue()
+        self._flusher = threading.Thread(target=self._flush_loop, name='audit-flusher', daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+        
+        # Versions of cached GET responses, bumped after every change to the underlying data
+        self._versions = itertools.count(1)
+        self.config_version = next(self._versions)
+        self.targets_version = next(self._versions)
         
         # Safety configuration
         self.safety_config = {
@@ -33,74 +134,225 @@ class SafetyLayer:
     
     def load_data(self):
         """Load existing safety data from files."""
+        self.migrate_legacy_audit_log()
+        self.audit_log = deque(maxlen=AUDIT_LOG_MAXLEN)
+        # Today's shard is created empty on startup, so skip empty shards to reach the latest entries
+        shards = [shard for shard in self.audit_shards() if os.path.getsize(shard) > 0]
+        for shard in shards[-AUDIT_LOG_LOAD_SHARDS:]:
+            self.audit_log.extend(read_jsonl(shard))
+        self._audit_ids = itertools.count(max((entry.get('id', 0) for entry in self.audit_log), default=0) + 1)
+        
         try:
-            with open(self.audit_file, 'r') as f:
-                self.audit_log = json.load(f)
-        except FileNotFoundError:
-            self.audit_log = []
-            
-        try:
-            with open(self.authorized_targets_file, 'r') as f:
-                self.authorized_targets = json.load(f)
+            with open(self.authorized_targets_file, 'rb') as f:
+                self.authorized_targets = orjson.loads(f.read())
         except FileNotFoundError:
             self.authorized_targets = []
-    
-    def save_data(self):
-        """Save safety data to files."""
-        with open(self.audit_file, 'w') as f:
-            json.dump(self.audit_log, f, indent=2)
         
-        with open(self.authorized_targets_file, 'w') as f:
-            json.dump(self.authorized_targets, f, indent=2)
+        # Backfill parsed expiry timestamps for authorizations saved before they existed
+        for authorization in self.authorized_targets:
+            if 'expiry_ts' not in authorization:
+                try:
+                    authorization['expiry_ts'] = parse_expiry(authorization.get('expiry_date'))
+                except ValueError:
+                    logger.warning(f"Invalid expiry date for authorization {authorization.get('id')}, treating it as expired")
+                    authorization['expiry_ts'] = 0.0
+        
+        self._authorization_ids = itertools.count(
+            max((authorization.get('id', 0) for authorization in self.authorized_targets), default=0) + 1
+        )
+        self.index_authorized_targets()
+    
+    def index_authorized_targets(self):
+        """Rebuild the lookup of active authorizations by domain."""
+        self._authorized_by_domain = {}
+        for authorization in self.authorized_targets:
+            self.index_authorization(authorization)
+    
+    def index_authorization(self, authorization):
+        """Add an authorization to the domain lookup if it is active."""
+        if authorization.get('status') == 'active':
+            # The earliest active authorization for a domain takes precedence
+            self._authorized_by_domain.setdefault(authorization.get('domain'), authorization)
+    
+    def audit_shard_path(self, day):
+        """Return the audit log file for a given day."""
+        return os.path.join(self.data_dir, f'audit_{day:%Y%m%d}.jsonl')
+    
+    def audit_shards(self):
+        """Return all audit log shard files, oldest first."""
+        return sorted(
+            os.path.join(self.data_dir, name) for name in os.listdir(self.data_dir)
+            if name.startswith('audit_') and name.endswith('.jsonl') and name[6:14].isdigit()
+        )
+    
+    def migrate_legacy_audit_log(self):
+        """Move a single-file audit log into the shard for the day it was last written."""
+        for name in ('audit_log.jsonl', 'audit_log.json'):
+            legacy_file = os.path.join(self.data_dir, name)
+            if not os.path.exists(legacy_file):
+                continue
+            shard = self.audit_shard_path(date.fromtimestamp(os.path.getmtime(legacy_file)))
+            if not os.path.exists(shard):
+                if name.endswith('.jsonl'):
+                    os.replace(legacy_file, shard)
+                else:
+                    read_jsonl(shard, legacy_file)
+            return
+    
+    def open_audit_shard(self, day):
+        """Point audit writes at the shard for the given day."""
+        self._audit_day = day
+        self.audit_file = self.audit_shard_path(day)
+        self._audit_fd = os.open(self.audit_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    
+    def save_authorized_targets(self):
+        """Atomically save the authorized targets to their file."""
+        tmp_file = self.authorized_targets_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(orjson.dumps(self.authorized_targets, option=orjson.OPT_INDENT_2))
+        os.replace(tmp_file, self.authorized_targets_file)
+    
+    def mark_dirty(self, name):
+        """Schedule a data file to be rewritten by the next flush."""
+        with self._lock:
+            self._dirty.add(name)
     
     def log_activity(self, activity_type, details, user_id=None):
         """Log an activity for audit purposes."""
+        # Keep the raw clock reading; it is formatted only when the entry is serialized
         log_entry = {
-            "id": len(self.audit_log) + 1,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": time.time_ns(),
             "activity_type": activity_type,
             "details": details,
             "user_id": user_id,
-            "ip_address": request.remote_addr if request else None
+            "ip_address": request.remote_addr if has_request_context() else None
         }
         
-        self.audit_log.append(log_entry)
-        self.save_data()
+        with self._lock:
+            log_entry = {"id": next(self._audit_ids), **log_entry}
+            self.audit_log.append(log_entry)
+        self._write_queue.put(log_entry)
         logger.info(f"Logged activity: {activity_type}")
         return log_entry
     
+    def get_audit_page(self, offset, limit):
+        """Return a page of in-memory audit entries and the number retained."""
+        with self._lock:
+            entries = list(itertools.islice(self.audit_log, max(offset, 0), max(offset, 0) + max(limit, 0)))
+            return entries, len(self.audit_log)
+    
+    def flush(self):
+        """Persist every audit entry queued so far and rewrite dirty files."""
+        batch = self._drain_queue()
+        if batch:
+            self.write_audit_batch(batch)
+            for _ in batch:
+                self._write_queue.task_done()
+        
+        # Wait for any batch the background flusher is still holding
+        self._write_queue.join()
+        self.flush_dirty()
+    
+    def flush_dirty(self):
+        """Rewrite only the data files that changed since the last flush."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        if 'authorized_targets' in dirty:
+            try:
+                with self._io_lock:
+                    self.save_authorized_targets()
+            except OSError:
+                # Retry on the next flush
+                self.mark_dirty('authorized_targets')
+                raise
+    
+    def write_audit_batch(self, batch):
+        """Append a batch of queued audit entries to the audit file."""
+        lines = [orjson.dumps(format_audit_entry(entry)) + b'\n' for entry in batch]
+        with self._io_lock:
+            today = date.today()
+            if today != self._audit_day:
+                os.close(self._audit_fd)
+                self.open_audit_shard(today)
+            
+            # One vectored write per batch instead of joining the lines into a new buffer
+            for start in range(0, len(lines), IOV_MAX):
+                chunk = lines[start:start + IOV_MAX]
+                written = os.writev(self._audit_fd, chunk)
+                if written < sum(map(len, chunk)):
+                    # Finish a short write with plain writes
+                    remaining = b''.join(chunk)[written:]
+                    while remaining:
+                        remaining = remaining[os.write(self._audit_fd, remaining):]
+    
+    def _drain_queue(self):
+        """Take every entry currently waiting in the write queue."""
+        batch = []
+        while True:
+            try:
+                batch.append(self._write_queue.get_nowait())
+            except queue.Empty:
+                return batch
+    
+    def _flush_loop(self):
+        """Persist queued audit entries and dirty files once a batch fills up or the flush interval passes."""
+        while True:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval_s
+            while len(batch) < self.flush_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._write_queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                if batch:
+                    try:
+                        self.write_audit_batch(batch)
+                    finally:
+                        for _ in batch:
+                            self._write_queue.task_done()
+                self.flush_dirty()
+            except Exception:
+                # Keep the flusher alive; a failed write must not stop later batches
+                logger.exception("Failed to persist safety data")
+    
     def is_target_authorized(self, target):
         """Check if a target is authorized for testing."""
-        target_domain = self.extract_domain(target)
-        
-        for authorized in self.authorized_targets:
-            if authorized.get('domain') == target_domain and authorized.get('status') == 'active':
-                return True, authorized
-        
+        authorized = self._authorized_by_domain.get(self.extract_domain(target))
+        if authorized:
+            return True, authorized
         return False, None
     
     def extract_domain(self, url):
         """Extract domain from URL."""
-        if url.startswith('http://') or url.startswith('https://'):
-            return url.split('/')[2]
-        return url.split('/')[0]
+        return extract_domain(url)
     
     def authorize_target(self, target_info, authorization_details):
         """Authorize a new target for testing."""
+        # Derive every computed field first so invalid input fails before an id is allocated
+        expiry_ts = parse_expiry(authorization_details.get('expiry_date'))
+        domain = self.extract_domain(target_info.get('url', ''))
+        
         authorization = {
-            "id": len(self.authorized_targets) + 1,
-            "domain": self.extract_domain(target_info.get('url', '')),
+            "id": next(self._authorization_ids),
+            "domain": domain,
             "target_info": target_info,
             "authorization_details": authorization_details,
             "status": "active",
             "authorized_by": authorization_details.get('authorized_by'),
             "authorization_date": datetime.now().isoformat(),
             "expiry_date": authorization_details.get('expiry_date'),
+            "expiry_ts": expiry_ts,
             "scope": authorization_details.get('scope', [])
         }
         
         self.authorized_targets.append(authorization)
-        self.save_data()
+        self.index_authorization(authorization)
+        self.mark_dirty('authorized_targets')
+        self.targets_version = next(self._versions)
         
         # Log the authorization
         self.log_activity("target_authorization", {
@@ -110,59 +362,50 @@ class SafetyLayer:
         
         return authorization
     
+    def update_config(self, updates):
+        """Apply known keys from updates to the safety configuration."""
+        for key, value in updates.items():
+            if key in self.safety_config:
+                self.safety_config[key] = value
+        self.config_version = next(self._versions)
+    
     def validate_attack_request(self, attack_request):
         """Validate an attack request against safety policies."""
-        validation_result = {
-            "valid": True,
-            "warnings": [],
-            "errors": [],
-            "recommendations": []
-        }
-        
         target = attack_request.get('target', {})
         target_url = target.get('url', '')
+        errors = []
         
         # Check if target is authorized
         if self.safety_config["require_authorization"]:
             is_authorized, auth_details = self.is_target_authorized(target_url)
             if not is_authorized:
-                validation_result["valid"] = False
-                validation_result["errors"].append(
-                    f"Target {target_url} is not authorized for testing"
-                )
+                errors.append(f"Target {target_url} is not authorized for testing")
             else:
                 # Check if authorization is still valid
-                if auth_details and auth_details.get('expiry_date'):
-                    expiry = datetime.fromisoformat(auth_details['expiry_date'])
-                    if datetime.now() > expiry:
-                        validation_result["valid"] = False
-                        validation_result["errors"].append(
-                            f"Authorization for {target_url} has expired"
-                        )
-        
-        # Check for dangerous techniques
-        dangerous_techniques = [
-            "data_destruction",
-            "system_compromise",
-            "unauthorized_access",
-            "malware_deployment"
-        ]
+                expiry_ts = auth_details.get('expiry_ts') if auth_details else None
+                if expiry_ts is not None and time.time() > expiry_ts:
+                    errors.append(f"Authorization for {target_url} has expired")
         
         objectives = attack_request.get('objectives', [])
+        
+        # Fast path: an authorized request without objectives has nothing to flag
+        if not errors and not objectives:
+            return VALID_RESULT
+        
+        validation_result = {
+            "valid": not errors,
+            "warnings": [],
+            "errors": errors,
+            "recommendations": SAFETY_RECOMMENDATIONS
+        }
+        
+        # Check for dangerous techniques in a single pass per objective
         for objective in objectives:
-            if any(dangerous in objective.lower() for dangerous in dangerous_techniques):
+            if next(DANGEROUS_TECHNIQUES_AUTOMATON.iter(objective.lower()), None):
                 validation_result["warnings"].append(
                     f"Potentially dangerous objective detected: {objective}"
                 )
         
-        # Add safety recommendations
-        validation_result["recommendations"].extend([
-            "Ensure all testing is conducted in a controlled environment",
-            "Obtain proper written authorization before testing",
-            "Document all activities for compliance purposes",
-            "Follow responsible disclosure practices for any findings"
-        ])
-        
         return validation_result
     
     def emergency_stop(self, reason):
@@ -219,6 +462,26 @@ def authorize_target():
                 "message": "target_info and authorization_details are required"
             }), 400
         
+        if not isinstance(target_info, dict) or not isinstance(authorization_details, dict):
+            return jsonify({
+                "status": "error",
+                "message": "target_info and authorization_details must be objects"
+            }), 400
+        
+        if not isinstance(target_info.get('url', ''), str):
+            return jsonify({
+                "status": "error",
+                "message": "target_info.url must be a string"
+            }), 400
+        
+        try:
+            parse_expiry(authorization_details.get('expiry_date'))
+        except (ValueError, TypeError):
+            return jsonify({
+                "status": "error",
+                "message": "expiry_date must be an ISO 8601 date"
+            }), 400
+        
         authorization = safety.authorize_target(target_info, authorization_details)
         
         logger.info(f"Authorized new target: {target_info.get('url', 'unknown')}")
@@ -237,7 +500,7 @@ def authorize_target():
 def get_authorized_targets():
     """Get all authorized targets."""
     try:
-        return jsonify({
+        return cached_json_response('authorized_targets', safety.targets_version, lambda: {
             "status": "success",
             "count": len(safety.authorized_targets),
             "authorized_targets": safety.authorized_targets
@@ -254,13 +517,13 @@ def get_audit_log():
         offset = request.args.get('offset', 0, type=int)
         
         # Get paginated results
-        log_entries = safety.audit_log[offset:offset + limit]
+        log_entries, total = safety.get_audit_page(offset, limit)
         
-        return jsonify({
+        return ojson({
             "status": "success",
             "count": len(log_entries),
-            "total": len(safety.audit_log),
-            "audit_log": log_entries
+            "total": total,
+            "audit_log": [format_audit_entry(entry) for entry in log_entries]
         })
     except Exception as e:
         logger.error(f"Error retrieving audit log: {str(e)}")
@@ -289,7 +552,7 @@ def emergency_stop():
 def get_safety_config():
     """Get current safety configuration."""
     try:
-        return jsonify({
+        return cached_json_response('safety_config', safety.config_version, lambda: {
             "status": "success",
             "safety_config": safety.safety_config
         })
@@ -303,15 +566,14 @@ def update_safety_config():
     try:
         data = request.get_json()
         
-        # Update configuration
-        for key, value in data.items():
-            if key in safety.safety_config:
-                safety.safety_config[key] = value
+        # Update configuration, keeping a snapshot of the previous values
+        old_config = safety.safety_config.copy()
+        safety.update_config(data)
         
         # Log configuration change
         safety.log_activity("config_update", {
-            "old_config": safety.safety_config,
-            "new_config": data
+            "old_config": old_config,
+            "new_config": safety.safety_config.copy()
         })
         
         return jsonify({
@@ -0,0 +1,64 @@
+"""
+LLM response cache for the RedHat AI Security Agent
+"""
+
+import blake3
+import orjson
+from diskcache import Cache
+
+class LLMCache:
+    """Persistent cache of model responses keyed by a hash of the request."""
+    
+    def __init__(self, directory):
+        self.cache = Cache(directory)
+    
+    @staticmethod
+    def make_key(model, messages, temperature):
+        """Hash a chat completion request into a cache key."""
+        payload = orjson.dumps([model, messages, temperature])
+        return blake3.blake3(payload).hexdigest()
+    
+    def get(self, key):
+        """Return the cached response for a key, or None."""
+        return self.cache.get(key)
+    
+    def set(self, key, response):
+        """Store a model response under a key."""
+        self.cache.set(key, response)
+    
+    def complete_json(self, client, model, messages, temperature, parse):
+        """Return parse(response) for a JSON-mode chat completion, calling the model only on a cache miss."""
+        key = self.make_key(model, messages, temperature)
+        response = self.get(key)
+        if response is not None:
+            return parse(response)
+        
+        completion = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            response_format={"type": "json_object"}
+        )
+        response = completion.choices[0].message.content
+        # Only responses that parse are worth caching
+        result = parse(response)
+        self.set(key, response)
+        return result
+    
+    async def acomplete_json(self, client, model, messages, temperature, parse):
+        """Async variant of complete_json for an AsyncOpenAI client."""
+        key = self.make_key(model, messages, temperature)
+        response = self.get(key)
+        if response is not None:
+            return parse(response)
+        
+        completion = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            response_format={"type": "json_object"}
+        )
+        response = completion.choices[0].message.content
+        result = parse(response)
+        self.set(key, response)
+        return result
@@ -2,24 +2,60 @@
 Logging utility for the RedHat AI Security Agent
 """
 
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
+import threading
+import time
 from datetime import datetime
 
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+LOG_DIR = os.path.join(BASE_DIR, 'logs')
+
+class BufferedFileHandler(logging.FileHandler):
+    """File handler that writes through a large buffer and flushes on an interval."""
+    
+    def __init__(self, filename, buffer_size=1 << 17, flush_interval=1.0):
+        self.buffer_size = buffer_size
+        super().__init__(filename)
+        self._flusher = threading.Thread(
+            target=self._flush_periodically, args=(flush_interval,), name='log-flusher', daemon=True
+        )
+        self._flusher.start()
+    
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=self.buffer_size,
+                    encoding=self.encoding, errors=self.errors)
+    
+    def emit(self, record):
+        """Write a record without flushing after each one."""
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+    
+    def _flush_periodically(self, interval):
+        while True:
+            time.sleep(interval)
+            self.flush()
+
 def setup_logging():
     """Setup logging configuration for the application."""
     
     # Create logs directory if it doesn't exist
-    log_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'logs')
-    os.makedirs(log_dir, exist_ok=True)
+    os.makedirs(LOG_DIR, exist_ok=True)
     
     # Configure logging
     log_level = os.environ.get('LOG_LEVEL', 'INFO').upper()
     log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     
     # File handler
-    log_file = os.path.join(log_dir, f'redhat_agent_{datetime.now().strftime("%Y%m%d")}.log')
-    file_handler = logging.FileHandler(log_file)
+    log_file = os.path.join(LOG_DIR, f'redhat_agent_{datetime.now().strftime("%Y%m%d")}.log')
+    file_handler = BufferedFileHandler(log_file)
     file_handler.setLevel(getattr(logging, log_level))
     file_handler.setFormatter(logging.Formatter(log_format))
     
@@ -28,11 +64,19 @@ def setup_logging():
     console_handler.setLevel(getattr(logging, log_level))
     console_handler.setFormatter(logging.Formatter(log_format))
     
+    # Both handlers run on a background listener so formatting and I/O stay off request threads
+    log_queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    listener = logging.handlers.QueueListener(
+        log_queue, file_handler, console_handler, respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)
+    
     # Root logger
     root_logger = logging.getLogger()
     root_logger.setLevel(getattr(logging, log_level))
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
+    root_logger.addHandler(queue_handler)
     
     # Application logger
     app_logger = logging.getLogger('redhat_agent')
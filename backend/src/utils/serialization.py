@@ -0,0 +1,102 @@
+"""
+Serialization utilities for the RedHat AI Security Agent
+"""
+
+import os
+import orjson
+from flask import Response
+from flask.json.provider import DefaultJSONProvider
+from utils.logger import get_logger
+
+logger = get_logger('serialization')
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson."""
+
+    def dumps(self, obj, **kwargs):
+        """Serialize obj to a JSON string using orjson."""
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        """Deserialize a JSON string or bytes using orjson."""
+        return orjson.loads(s)
+
+def ojson(obj, status=200):
+    """Build a JSON response serialized straight to bytes with orjson."""
+    return Response(orjson.dumps(obj), status=status, mimetype='application/json')
+
+def stream_json_list(envelope, key, items):
+    """Stream a JSON object ending in a list, serializing one item at a time."""
+    # Lists are only ever appended to, so a count taken now gives a consistent snapshot
+    count = len(items)
+    
+    def generate():
+        head = orjson.dumps({**envelope, "count": count})
+        yield head[:-1] + b',' + orjson.dumps(key) + b':['
+        for position in range(count):
+            yield (b',' if position else b'') + orjson.dumps(items[position])
+        yield b']}'
+    
+    return Response(generate(), mimetype='application/json')
+
+def stream_jsonl_map(envelope, key, count, mapped, chunk_size=1 << 16):
+    """Stream a JSON object ending in a list whose items are the lines of a mapped JSONL file."""
+    
+    def generate():
+        head = orjson.dumps({**envelope, "count": count})
+        yield head[:-1] + b',' + orjson.dumps(key) + b':['
+        if mapped is not None:
+            try:
+                # orjson escapes newlines inside strings, so every raw newline ends a record
+                size = len(mapped)
+                for start in range(0, size, chunk_size):
+                    chunk = mapped[start:start + chunk_size]
+                    if start + chunk_size >= size:
+                        chunk = chunk.rstrip(b'\n')
+                    yield chunk.replace(b'\n', b',')
+            finally:
+                mapped.close()
+        yield b']}'
+    
+    return Response(generate(), mimetype='application/json')
+
+def read_jsonl(path, legacy_path=None):
+    """Read records from a JSONL file, falling back to a legacy JSON array file."""
+    records = []
+    try:
+        with open(path, 'rb+') as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    try:
+                        records.append(orjson.loads(line))
+                    except orjson.JSONDecodeError:
+                        if line.endswith(b'\n'):
+                            raise
+                        # A write interrupted mid-append leaves a torn last line; cut it off so
+                        # the next append starts on a fresh line
+                        logger.warning("Discarding torn trailing record in %s", path)
+                        f.truncate(offset)
+                        line = b'\n'
+                offset += len(line)
+            if offset and not line.endswith(b'\n'):
+                # The last record is complete but its newline was never written
+                f.write(b'\n')
+    except FileNotFoundError:
+        if legacy_path and os.path.exists(legacy_path):
+            with open(legacy_path, 'rb') as f:
+                records = orjson.loads(f.read())
+            write_jsonl(path, records)
+    return records
+
+def write_jsonl(path, records):
+    """Atomically rewrite a JSONL file with the given records."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(b''.join(orjson.dumps(record) + b'\n' for record in records))
+    os.replace(tmp_path, path)
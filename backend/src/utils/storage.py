@@ -0,0 +1,91 @@
+"""
+Storage utilities for the RedHat AI Security Agent
+"""
+
+import atexit
+import mmap
+import os
+import threading
+import time
+import orjson
+from utils.logger import BASE_DIR, get_logger
+from utils.serialization import write_jsonl
+
+logger = get_logger('storage')
+
+# Shared by every module that persists data
+DATA_DIR = os.path.join(BASE_DIR, 'data')
+os.makedirs(DATA_DIR, exist_ok=True)
+
+class JsonlWriter:
+    """Append-only JSONL writer that batches appends on a background thread."""
+    
+    def __init__(self, path, flush_delay=0.1):
+        self.path = path
+        self.flush_delay = flush_delay
+        self._lock = threading.Lock()
+        self._pending = []
+        self._dirty = threading.Event()
+        
+        self._thread = threading.Thread(target=self._run, name=f'jsonl-writer:{path}', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+    
+    def append(self, record):
+        """Queue a record to be appended to the file."""
+        self.extend([record])
+    
+    def extend(self, records):
+        """Queue several records to be appended to the file."""
+        # Serialize now so later in-place edits of a record don't leak into this version
+        lines = [orjson.dumps(record) + b'\n' for record in records]
+        if not lines:
+            return
+        with self._lock:
+            self._pending.extend(lines)
+        self._dirty.set()
+    
+    def flush(self):
+        """Write all queued records to the file."""
+        with self._lock:
+            if not self._pending:
+                return
+            data = memoryview(b''.join(self._pending))
+            with open(self.path, 'ab', buffering=0) as f:
+                start = f.tell()
+                try:
+                    while data:
+                        data = data[f.write(data):]
+                except OSError:
+                    # Undo a partial append so the retry does not leave a torn record
+                    f.truncate(start)
+                    raise
+            # Only drop the records once they are on disk so a failed write is retried
+            self._pending = []
+    
+    def map(self):
+        """Flush queued records and map the file read-only, or return None if it is empty."""
+        self.flush()
+        try:
+            with open(self.path, 'rb') as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # mmap rejects empty files
+            return None
+    
+    def rewrite(self, records):
+        """Atomically replace the file contents, discarding queued appends."""
+        with self._lock:
+            self._pending = []
+            write_jsonl(self.path, records)
+    
+    def _run(self):
+        """Flush queued records shortly after they arrive."""
+        while True:
+            self._dirty.wait()
+            time.sleep(self.flush_delay)
+            self._dirty.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush %s", self.path)
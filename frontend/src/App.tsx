@@ -17,7 +17,7 @@ import './App.css';
 const API_BASE_URL = 'http://localhost:5000';
 
 interface Technique {
-  id: number;
+  id: string | number;
   name: string;
   description: string;
   category: string;
@@ -27,7 +27,7 @@ interface Technique {
 }
 
 interface AttackPlan {
-  id: number;
+  id: string | number;
   target: any;
   objectives: string[];
   status: string;